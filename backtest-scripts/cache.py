@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import time
+from pathlib import Path
+
+class FileCache:
+    """Disk cache for parsed API payloads, keyed by request parameters.
+
+    Fully-closed historical candles never change, so those chunks can be
+    stored with ttl="forever"; the trailing (still-open) chunk should use
+    a short TTL so reruns pick up the latest bar.
+    """
+
+    def __init__(self, cache_dir=".cache", ttl_days=90):
+        self.cache_dir = Path(cache_dir)
+        self.default_ttl = ttl_days * 24 * 60 * 60
+
+    @staticmethod
+    def make_key(params):
+        """Stable hash of the request parameters"""
+        return hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def _paths(self, endpoint, key):
+        endpoint_dir = self.cache_dir / endpoint
+        return endpoint_dir / f"{key}.json", endpoint_dir / f"{key}.meta.json"
+
+    def get(self, endpoint, key, allow_expired=False):
+        """Return the cached payload, or None on a miss or expired entry.
+
+        allow_expired skips the TTL check, for callers that revalidate an
+        expired entry some other way (e.g. an HTTP 304 response).
+        """
+        data_path, meta_path = self._paths(endpoint, key)
+        if not data_path.exists() or not meta_path.exists():
+            return None
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+            ttl = meta.get('ttl', self.default_ttl)
+            if not allow_expired and ttl != 'forever' and time.time() - meta['timestamp'] > ttl:
+                return None
+
+            with open(data_path) as f:
+                return json.load(f)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def prune(self):
+        """Delete expired entries so the cache directory doesn't grow unbounded"""
+        now = time.time()
+        for meta_path in self.cache_dir.glob('*/*.meta.json'):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                ttl = meta.get('ttl', self.default_ttl)
+                if ttl == 'forever' or now - meta['timestamp'] <= ttl:
+                    continue
+            except (OSError, ValueError, KeyError):
+                pass  # unreadable meta: drop the entry too
+
+            meta_path.with_name(meta_path.name[:-len('.meta.json')] + '.json').unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+
+    def put(self, endpoint, key, payload, params=None, ttl=None):
+        """Store a payload with a sidecar meta file holding timestamp + TTL"""
+        data_path, meta_path = self._paths(endpoint, key)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(data_path, 'w') as f:
+            json.dump(payload, f)
+
+        meta = {
+            'timestamp': time.time(),
+            'ttl': ttl if ttl is not None else self.default_ttl,
+            'params': params or {}
+        }
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""Helpers shared by the OKX and Binance historical-data fetchers.
+
+Both scripts drive the same pipeline — rate-limited JSON requests with
+retries, window-tagged progress sidecars, columnar output rows and the
+common Fear & Greed feed — so everything that doesn't depend on an
+exchange lives here, parameterized by each script's limiter, semaphore
+and cache.
+"""
+
+import asyncio
+import logging
+
+import aiohttp
+import numpy as np
+import orjson
+import pandas as pd
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+from cache import FileCache
+from ndjson import load_rows_lenient
+
+logger = logging.getLogger(__name__)
+
+@retry(wait=wait_exponential_jitter(initial=0.5, max=30),
+       stop=stop_after_attempt(6),
+       retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError)),
+       reraise=True)
+async def request_json(session, url, params, limiter, semaphore, headers=None):
+    """Issue one rate-limited GET, retrying transient failures with backoff.
+
+    Returns the decoded body, or None for non-retryable client errors.
+    """
+    async with limiter:
+        async with semaphore:
+            async with session.get(url, params=params, headers=headers) as response:
+                status = response.status
+                if status == 200:
+                    return orjson.loads(await response.read())
+
+                if status == 429:
+                    # Respect the server's pacing hint before the next
+                    # attempt; Retry-After may be an HTTP-date rather than
+                    # seconds, so fall back to 1s on anything non-numeric
+                    try:
+                        delay = float(response.headers.get('Retry-After', 1))
+                    except ValueError:
+                        delay = 1.0
+                    await asyncio.sleep(delay)
+
+                if status == 429 or status >= 500:
+                    # Raise so tenacity retries; both are transient
+                    response.raise_for_status()
+
+                # Other 4xx won't get better on retry: log and give up
+                # without paying for an exception
+                logger.warning("HTTP %d from %s: %s", status, url, (await response.text())[:200])
+                return None
+
+def empty_chunk():
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+def load_progress(progress_path):
+    """Map chunk windows to their columns from an interrupted run's sidecar.
+
+    Chunks append in completion order, so the sidecar holds an arbitrary
+    subset of windows — not a contiguous prefix. Returning the records
+    keyed by window lets the caller schedule exactly the missing ones.
+    Records are validated one by one: a crash can tear the final line
+    mid-append, and that must not discard every completed chunk.
+    """
+    try:
+        records = load_rows_lenient(progress_path)
+    except OSError:
+        return {}
+
+    windows = {}
+    for r in records:
+        try:
+            windows[(r['chunk_start'], r['chunk_end'])] = (
+                np.asarray(r['ts_ms'], dtype=np.int64),
+                np.asarray(r['closes'], dtype=np.float64),
+            )
+        except (KeyError, TypeError, ValueError):
+            continue  # pre-window or otherwise malformed record
+    return windows
+
+def price_rows(symbol, price_data):
+    """Yield backtest price rows from the columnar frame, reusing one dict.
+
+    write_json_array serializes each row before pulling the next, so
+    mutating a single template (and its nested prices dict) in place is
+    safe and skips two dict allocations per row.
+    """
+    row = {'timestamp': None, 'prices': {symbol: None}}
+    prices = row['prices']
+    ts_strs = price_data['timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    for ts_str, close in zip(ts_strs, price_data[symbol].tolist()):
+        row['timestamp'] = ts_str
+        prices[symbol] = close
+        yield row
+
+async def fetch_fear_greed_data(session, days, cache, newest_first=False):
+    """Fetch Fear & Greed index historical data.
+
+    The cache holds the series oldest-first regardless of caller, so both
+    fetchers can share a warm entry; newest_first reverses at the cache
+    boundaries for the OKX script, which has always emitted newest-first.
+    """
+    url = f"https://api.alternative.me/fng/?limit={days}"
+
+    cache_params = {'endpoint': 'fear_greed', 'limit': days}
+    cache_key = FileCache.make_key(cache_params)
+    if (hit := cache.get('fear_greed', cache_key)) is not None:
+        print("Cache hit for Fear & Greed data")
+        return hit[::-1] if newest_first else hit
+
+    # The cached copy expired, but the historic part of the series is
+    # immutable: send the stored validators so the server can answer 304
+    # with no body when nothing changed
+    stale = cache.get('fear_greed', cache_key, allow_expired=True)
+    validator_path = cache.cache_dir / 'fear_greed' / f'{cache_key}.http.json'
+    cond_headers = {}
+    if stale is not None:
+        try:
+            validators = orjson.loads(validator_path.read_bytes())
+            if 'etag' in validators:
+                cond_headers['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                cond_headers['If-Modified-Since'] = validators['last_modified']
+        except (OSError, ValueError):
+            pass
+
+    try:
+        async with session.get(url, headers=cond_headers) as response:
+            if response.status == 304:
+                print("Fear & Greed data unchanged (304), reusing cached payload")
+                cache.put('fear_greed', cache_key, stale, params=cache_params, ttl=60 * 60)
+                return stale[::-1] if newest_first else stale
+
+            response.raise_for_status()
+            resp_headers = response.headers
+            data = orjson.loads(await response.read())
+
+        items = data['data']
+        ts_strs = pd.to_datetime([int(item['timestamp']) for item in items],
+                                 unit='s', utc=True).strftime('%Y-%m-%dT%H:%M:%SZ')
+        fear_greed_data = [
+            {
+                'timestamp': ts_str,
+                'value': int(item['value']),
+                'classification': item['value_classification']
+            }
+            for ts_str, item in zip(ts_strs, items)
+        ]
+
+        # alternative.me returns newest-first; flip to oldest-first, the
+        # canonical cache order (and the order the Binance series ships in)
+        fear_greed_data.reverse()
+
+        # The index updates once a day, so an hour of freshness is plenty
+        cache.put('fear_greed', cache_key, fear_greed_data, params=cache_params, ttl=60 * 60)
+
+        # Remember the response validators for the next run's conditional GET
+        validators = {}
+        if resp_headers.get('ETag'):
+            validators['etag'] = resp_headers['ETag']
+        if resp_headers.get('Last-Modified'):
+            validators['last_modified'] = resp_headers['Last-Modified']
+        if validators:
+            validator_path.parent.mkdir(parents=True, exist_ok=True)
+            validator_path.write_bytes(orjson.dumps(validators))
+
+        return fear_greed_data[::-1] if newest_first else fear_greed_data
+
+    except aiohttp.ClientError as e:
+        print(f"Error fetching Fear & Greed data: {e}")
+        return []
@@ -1,14 +1,27 @@
 #!/usr/bin/env python3
 
-import requests
-import json
+import aiohttp
+import asyncio
 import time
 import hmac
 import hashlib
 import base64
-from datetime import datetime, timedelta
+from datetime import datetime
+from pathlib import Path
 import argparse
 
+import logging
+
+import numpy as np
+import pandas as pd
+from aiolimiter import AsyncLimiter
+
+from cache import FileCache
+from fetch_common import empty_chunk, fetch_fear_greed_data, load_progress, price_rows, request_json
+from ndjson import append_rows, write_json_array
+
+logger = logging.getLogger(__name__)
+
 try:
     from okx_config import OKX_API_CONFIG
 except ImportError:
@@ -20,25 +33,38 @@ except ImportError:
         "sandbox": False
     }
 
+# Stay under OKX's public rate limit of 20 requests per 2 seconds
+_OKX_LIMITER = AsyncLimiter(18, 2)
+# Cap in-flight requests per host so bursts don't pile up on one
+# connection; constructing the semaphore at import time relies on the
+# lazy loop binding of Python 3.10+, the documented floor
+_PER_HOST_LIMIT = 8
+_OKX_SEM = asyncio.Semaphore(_PER_HOST_LIMIT)
+
+# Closed candles are immutable, so cached chunks survive across reruns
+_CACHE = FileCache()
+_BAR_MS = 24 * 60 * 60 * 1000  # 1D bars
+
+# Key the HMAC once per run: copy() clones the already-keyed SHA256 state,
+# so each request only pays the final update + digest instead of rekeying
+_HMAC_TEMPLATE = (
+    hmac.new(OKX_API_CONFIG["api_secret"].encode('utf-8'), digestmod=hashlib.sha256)
+    if OKX_API_CONFIG["api_key"] else None
+)
+
 def get_okx_headers():
     """Generate OKX API headers with authentication"""
-    if not OKX_API_CONFIG["api_key"]:
+    if _HMAC_TEMPLATE is None:
         return {}
-    
+
     timestamp = str(int(time.time()))
-    method = "GET"
     request_path = "/api/v5/market/candles"
-    
-    # Create signature
-    message = timestamp + method + request_path
-    signature = base64.b64encode(
-        hmac.new(
-            OKX_API_CONFIG["api_secret"].encode('utf-8'),
-            message.encode('utf-8'),
-            hashlib.sha256
-        ).digest()
-    ).decode('utf-8')
-    
+
+    # Create signature from the precomputed HMAC state
+    h = _HMAC_TEMPLATE.copy()
+    h.update(f"{timestamp}GET{request_path}".encode('utf-8'))
+    signature = base64.b64encode(h.digest()).decode('utf-8')
+
     return {
         'OK-ACCESS-KEY': OKX_API_CONFIG["api_key"],
         'OK-ACCESS-SIGN': signature,
@@ -47,168 +73,218 @@ def get_okx_headers():
         'Content-Type': 'application/json'
     }
 
-def fetch_okx_historical_data(symbol, days):
-    """Fetch historical price data from OKX API with proper pagination and chunking"""
-    
-    # Calculate start and end timestamps
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=days)
-    
-    # Convert to milliseconds
-    start_ts = int(start_time.timestamp() * 1000)
-    end_ts = int(end_time.timestamp() * 1000)
-    
-    print(f"Fetching data from {start_time} to {end_time}")
-    print(f"Total hours needed: {days * 24}")
-    
+async def fetch_okx_chunk(session, symbol, chunk_start_ts, chunk_end_ts, progress_path):
+    """Fetch one chunk of candles covering [chunk_start_ts, chunk_end_ts).
+
+    Returns (timestamps_ms, closes) as a pair of NumPy columns.
+    """
     url = "https://www.okx.com/api/v5/market/candles"
-    
-    all_data = []
-    
-    # Break into chunks to handle API limits
+
+    cache_params = {
+        'endpoint': 'okx_candles',
+        'instId': f'{symbol}-USDT',
+        'bar': '1D',
+        'after': chunk_end_ts,
+        'before': chunk_start_ts - 1
+    }
+    cache_key = FileCache.make_key(cache_params)
+    if (hit := _CACHE.get('okx_candles', cache_key)) is not None and isinstance(hit, dict) and 'chunk_start' in hit:
+        logger.debug("Cache hit for chunk ending %s", datetime.fromtimestamp(chunk_end_ts/1000))
+        append_rows(progress_path, [hit])
+        return np.asarray(hit['ts_ms'], dtype=np.int64), np.asarray(hit['closes'], dtype=np.float64)
+
+    # after/before bound the window server-side and are both strict
+    # ("earlier than"/"newer than"), so before is nudged one ms below the
+    # window start — otherwise a candle opening exactly on a chunk edge
+    # would be returned by neither neighbouring chunk. limit=300
+    # comfortably covers a whole chunk, so each chunk is one request
+    params = {
+        'instId': f'{symbol}-USDT',
+        'bar': '1D',  # Daily instead of hourly
+        'limit': 300,
+        'after': str(chunk_end_ts),
+        'before': str(chunk_start_ts - 1)
+    }
+
+    data = await request_json(session, url, params, _OKX_LIMITER, _OKX_SEM, get_okx_headers())
+    if data is None:
+        return empty_chunk()
+
+    if data['code'] != '0':
+        logger.warning("Error from OKX API: %s", data['msg'])
+        return empty_chunk()
+
+    candles = data['data']
+
+    ts_ms, closes = empty_chunk()
+    if candles:
+        # Parse columns with NumPy instead of per-row int()/float() calls;
+        # the mask clips rows to [chunk_start_ts, chunk_end_ts) in case the
+        # server bounds are looser than documented
+        arr = np.asarray(candles, dtype=object)
+        ts_ms = arr[:, 0].astype(np.int64)
+        closes = arr[:, 4].astype(np.float64)  # Close price
+        mask = (ts_ms >= chunk_start_ts) & (ts_ms < chunk_end_ts)
+        ts_ms = ts_ms[mask]
+        closes = closes[mask]
+
+    # Chunks made entirely of closed bars never change; the trailing
+    # chunk still gets new bars, so it only stays fresh for a minute
+    now_ms = int(time.time() * 1000)
+    ttl = 'forever' if chunk_end_ts < now_ms - _BAR_MS else 60
+    payload = {'chunk_start': chunk_start_ts, 'chunk_end': chunk_end_ts,
+               'ts_ms': ts_ms.tolist(), 'closes': closes.tolist()}
+    _CACHE.put('okx_candles', cache_key, payload, params=cache_params, ttl=ttl)
+
+    # Stream the chunk columns out as soon as they land so a crashed run
+    # still leaves usable partial progress on disk
+    append_rows(progress_path, [payload])
+
+    logger.debug("Fetched %d candles for chunk ending %s", len(ts_ms), datetime.fromtimestamp(chunk_end_ts/1000))
+    return ts_ms, closes
+
+async def fetch_okx_historical_data(session, symbol, days):
+    """Fetch historical price data from OKX API with concurrent chunk fetches.
+
+    Returns a columnar DataFrame with a UTC 'timestamp' column and one
+    price column named after the symbol.
+    """
+
+    # Anchor the end of the window to the bar grid: a raw datetime.now()
+    # end would shift every chunk window — and every cache key derived
+    # from it — by a few milliseconds per run, so closed-chunk cache
+    # entries could never be hit again. Flooring also drops the still-open
+    # trailing bar, so the dataset only ever contains closed candles
+    end_ts = int(datetime.now().timestamp() * 1000) // _BAR_MS * _BAR_MS
+    start_ts = end_ts - days * _BAR_MS
+
+    print(f"Fetching data from {datetime.fromtimestamp(start_ts/1000)} to {datetime.fromtimestamp(end_ts/1000)}")
+    print(f"Total hours needed: {days * 24}")
+
+    # NDJSON sidecar collects one window-tagged record per finished chunk,
+    # in completion order; the exchange suffix keeps the 1D OKX and 1h
+    # Binance fetchers from absorbing each other's leftovers
+    progress_path = f"../backtest-data/{symbol.lower()}_prices_{days}d.okx.jsonl"
+
+    # Materialize the chunk edges as one int64 array instead of stepping a
+    # cursor in Python; consecutive edge pairs are the (start, end) windows
     chunk_hours = 100  # Fetch 100 hours at a time
-    current_end_ts = end_ts
-    
-    while current_end_ts > start_ts:
-        current_start_ts = max(start_ts, current_end_ts - (chunk_hours * 60 * 60 * 1000))
-        
-        print(f"Fetching chunk: {datetime.fromtimestamp(current_start_ts/1000)} to {datetime.fromtimestamp(current_end_ts/1000)}")
-        
-        chunk_data = []
-        current_ts = current_end_ts
-        
-        # Fetch this chunk
-        while current_ts > current_start_ts and len(chunk_data) < chunk_hours:
-            params = {
-                'instId': f'{symbol}-USDT',
-                'bar': '1D',  # Daily instead of hourly
-                'limit': 100,
-                'before': str(current_ts)
-            }
-            
-            try:
-                headers = get_okx_headers()
-                response = requests.get(url, params=params, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                
-                if data['code'] != '0':
-                    print(f"Error from OKX API: {data['msg']}")
-                    break
-                    
-                if not data['data']:
-                    print("No more data available from API")
-                    break
-                    
-                candles = data['data']
-                added_in_batch = 0
-                
-                for candle in candles:
-                    timestamp = int(candle[0])
-                    if timestamp < current_start_ts:
-                        break
-                        
-                    price_data = {
-                        'timestamp': datetime.fromtimestamp(timestamp / 1000).isoformat() + 'Z',
-                        'prices': {
-                            symbol: float(candle[4])  # Close price
-                        }
-                    }
-                    chunk_data.append(price_data)
-                    added_in_batch += 1
-                    
-                if added_in_batch == 0:
-                    break
-                    
-                # Update current timestamp for next iteration
-                current_ts = int(candles[-1][0])
-                
-                # Rate limiting
-                time.sleep(0.5)
-                
-            except requests.RequestException as e:
-                print(f"Request error: {e}")
-                break
-            except Exception as e:
-                print(f"Unexpected error: {e}")
-                break
-        
-        print(f"Fetched {len(chunk_data)} candles for this chunk")
-        all_data.extend(chunk_data)
-        
-        # Move to next chunk
-        current_end_ts = current_start_ts
-        
-        # Longer pause between chunks
-        if current_end_ts > start_ts:
-            print("Pausing 2 seconds between chunks...")
-            time.sleep(2)
-    
-    # Sort by timestamp (oldest first)
-    all_data.sort(key=lambda x: x['timestamp'])
-    
-    print(f"Successfully fetched {len(all_data)} data points")
-    if all_data:
-        print(f"Date range: {all_data[0]['timestamp']} to {all_data[-1]['timestamp']}")
-    
-    return all_data
-
-def fetch_fear_greed_data(days):
-    """Fetch Fear & Greed index historical data"""
-    url = f"https://api.alternative.me/fng/?limit={days}"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        fear_greed_data = []
-        for item in data['data']:
-            fear_greed_data.append({
-                'timestamp': datetime.fromtimestamp(int(item['timestamp'])).isoformat() + 'Z',
-                'value': int(item['value']),
-                'classification': item['value_classification']
-            })
-            
-        return fear_greed_data
-        
-    except requests.RequestException as e:
-        print(f"Error fetching Fear & Greed data: {e}")
-        return []
-
-def main():
+    chunk_ms = chunk_hours * 60 * 60 * 1000
+    if end_ts > start_ts:
+        # Interior edges snap to the epoch-aligned chunk grid so the same
+        # closed windows (and cache keys) recur run after run; only the
+        # partial windows at both ends move with the requested range
+        interior = np.arange((end_ts - 1) // chunk_ms * chunk_ms, start_ts, -chunk_ms, dtype=np.int64)
+        edges = np.concatenate((np.asarray([end_ts], dtype=np.int64), interior,
+                                np.asarray([start_ts], dtype=np.int64)))
+        schedule = [(int(cs), int(ce)) for cs, ce in zip(edges[1:], edges[:-1])]
+    else:
+        schedule = []
+
+    # Chunks complete out of order, so an interrupted run leaves an
+    # arbitrary subset of windows in the sidecar — not a prefix. Reuse
+    # exactly the records whose windows are in the current schedule and
+    # fetch only the missing ones; resuming from the extremes instead
+    # would silently skip every unfinished window in between
+    scheduled = set(schedule)
+    done = {w: cols for w, cols in load_progress(progress_path).items() if w in scheduled}
+    if done:
+        print(f"Resuming {symbol}: {len(done)} of {len(schedule)} chunks already on disk")
+    else:
+        open(progress_path, 'wb').close()
+    pending = [w for w in schedule if w not in done]
+
+    fetched = await asyncio.gather(
+        *[fetch_okx_chunk(session, symbol, cs, ce, progress_path) for cs, ce in pending]
+    )
+    by_window = {**done, **dict(zip(pending, fetched))}
+    chunks = [by_window[w] for w in schedule]
+
+    # OKX returns candles newest-first and the schedule walks backward, so
+    # the concatenation is already fully descending: a single [::-1] view
+    # yields chronological order without a comparison sort
+    empty_ts, empty_closes = empty_chunk()
+    ts_ms = np.concatenate([empty_ts, *[c[0] for c in chunks]])[::-1]
+    closes = np.concatenate([empty_closes, *[c[1] for c in chunks]])[::-1]
+
+    # Safety net against inclusive server bounds: keep the first
+    # occurrence of each timestamp, as the Binance merge does
+    ts_ms, first_idx = np.unique(ts_ms, return_index=True)
+    closes = closes[first_idx]
+
+    # One timestamp column plus one price column per symbol: two typed
+    # arrays instead of thousands of nested per-row dicts
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(ts_ms, unit='ms', utc=True),
+        symbol: closes
+    })
+
+    print(f"Successfully fetched {len(df)} data points")
+    if not df.empty:
+        print(f"Date range: {df['timestamp'].iloc[0]} to {df['timestamp'].iloc[-1]}")
+
+    return df
+
+async def main():
     parser = argparse.ArgumentParser(description='Fetch historical data for backtesting')
     parser.add_argument('--days', type=int, default=180, help='Number of days to fetch (default: 180)')
     parser.add_argument('--symbols', nargs='+', default=['BTC', 'SOL'], help='Crypto symbols to fetch')
-    
+
     args = parser.parse_args()
-    
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # Expired short-TTL entries accumulate one per run; clear them out
+    _CACHE.prune()
+
     print(f"Fetching {args.days} days of historical data for {args.symbols}")
-    
-    # Fetch price data for each symbol
-    for symbol in args.symbols:
-        print(f"Fetching price data for {symbol}...")
-        price_data = fetch_okx_historical_data(symbol, args.days)
-        
-        if price_data:
-            filename = f"../backtest-data/{symbol.lower()}_prices_{args.days}d.json"
-            with open(filename, 'w') as f:
-                json.dump(price_data, f, indent=2)
-            print(f"Saved {len(price_data)} price points to {filename}")
+
+    # All symbols and the Fear & Greed index fetch concurrently over one
+    # session; the shared limiter keeps the global request rate legal
+    # One long-lived connector for the whole run: DNS answers are cached
+    # for 5 minutes and idle keep-alive sockets are reused across chunks
+    # instead of re-resolving and re-handshaking per request
+    connector = aiohttp.TCPConnector(
+        limit=32,
+        limit_per_host=_PER_HOST_LIMIT,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [fetch_okx_historical_data(session, symbol, args.days) for symbol in args.symbols]
+        tasks.append(fetch_fear_greed_data(session, args.days, _CACHE, newest_first=True))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    fear_greed_data = results.pop()
+
+    for symbol, price_data in zip(args.symbols, results):
+        if isinstance(price_data, Exception):
+            print(f"Error fetching price data for {symbol}: {price_data}")
+        elif not price_data.empty:
+            base = f"../backtest-data/{symbol.lower()}_prices_{args.days}d"
+
+            # Parquet is the compact columnar artifact for fast reloads;
+            # the row-oriented .json stays for the Rust backtest loader
+            price_data.to_parquet(f"{base}.parquet", compression='zstd')
+
+            write_json_array(f"{base}.json", price_rows(symbol, price_data))
+
+            # The progress sidecar is redundant once the final files exist
+            Path(f"{base}.okx.jsonl").unlink(missing_ok=True)
+
+            print(f"Saved {len(price_data)} price points to {base}.json")
         else:
             print(f"No data fetched for {symbol}")
-    
-    # Fetch Fear & Greed data
-    print("Fetching Fear & Greed index data...")
-    fear_greed_data = fetch_fear_greed_data(args.days)
-    
-    if fear_greed_data:
+
+    if isinstance(fear_greed_data, Exception):
+        print(f"Error fetching Fear & Greed data: {fear_greed_data}")
+    elif fear_greed_data:
         filename = f"../backtest-data/fear_greed_{args.days}d.json"
-        with open(filename, 'w') as f:
-            json.dump(fear_greed_data, f, indent=2)
+        write_json_array(filename, fear_greed_data)
         print(f"Saved {len(fear_greed_data)} Fear & Greed points to {filename}")
-    
+
     print("Historical data fetch completed!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
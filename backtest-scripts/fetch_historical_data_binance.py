@@ -1,164 +1,232 @@
 #!/usr/bin/env python3
 
-import requests
-import json
+import aiohttp
+import asyncio
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+from pathlib import Path
 import argparse
 
-def fetch_binance_historical_data(symbol, days):
-    """Fetch historical price data from Binance API"""
-    
-    # Calculate start and end timestamps (Binance uses milliseconds)
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=days)
-    
-    start_ms = int(start_time.timestamp() * 1000)
-    end_ms = int(end_time.timestamp() * 1000)
-    
-    print(f"Fetching data from {start_time} to {end_time}")
-    print(f"Total hours needed: {days * 24}")
-    
+import logging
+
+import numpy as np
+import pandas as pd
+from aiolimiter import AsyncLimiter
+
+from cache import FileCache
+from fetch_common import empty_chunk, fetch_fear_greed_data, load_progress, price_rows, request_json
+from ndjson import append_rows, write_json_array
+
+logger = logging.getLogger(__name__)
+
+# Stay under Binance's 1200 request-weight/minute limit with some headroom
+_BINANCE_LIMITER = AsyncLimiter(1100, 60)
+# Cap in-flight requests per host so bursts don't pile up on one
+# connection; constructing the semaphore at import time relies on the
+# lazy loop binding of Python 3.10+, the documented floor
+_PER_HOST_LIMIT = 8
+_BINANCE_SEM = asyncio.Semaphore(_PER_HOST_LIMIT)
+
+# Closed candles are immutable, so cached chunks survive across reruns
+_CACHE = FileCache()
+_BAR_MS = 60 * 60 * 1000  # 1h bars
+
+async def fetch_binance_chunk(session, symbol, chunk_start_ms, chunk_end_ms, max_candles, progress_path):
+    """Fetch one chunk of klines between the given millisecond timestamps.
+
+    Returns (timestamps_ms, closes) as a pair of NumPy columns.
+    """
     url = "https://api.binance.com/api/v3/klines"
-    
-    all_data = []
-    current_start_ms = start_ms
-    
+
+    cache_params = {
+        'endpoint': 'binance_klines',
+        'symbol': f'{symbol}USDT',
+        'interval': '1h',
+        'chunk_start': chunk_start_ms,
+        'chunk_end': chunk_end_ms
+    }
+    cache_key = FileCache.make_key(cache_params)
+    if (hit := _CACHE.get('binance_klines', cache_key)) is not None and isinstance(hit, dict) and 'chunk_start' in hit:
+        logger.debug("Cache hit for chunk starting %s", datetime.fromtimestamp(chunk_start_ms/1000))
+        append_rows(progress_path, [hit])
+        return np.asarray(hit['ts_ms'], dtype=np.int64), np.asarray(hit['closes'], dtype=np.float64)
+
+    params = {
+        'symbol': f'{symbol}USDT',
+        'interval': '1h',
+        'startTime': chunk_start_ms,
+        'endTime': chunk_end_ms,
+        'limit': max_candles
+    }
+
+    candles = await request_json(session, url, params, _BINANCE_LIMITER, _BINANCE_SEM)
+    if candles is None:
+        return empty_chunk()
+
+    logger.debug("Received %d candles for chunk starting %s", len(candles), datetime.fromtimestamp(chunk_start_ms/1000))
+
+    # Parse the kline columns with NumPy instead of per-row int()/float()
+    ts_ms, closes = empty_chunk()
+    if candles:
+        arr = np.asarray(candles, dtype=object)
+        ts_ms = arr[:, 0].astype(np.int64)  # Open time in milliseconds
+        closes = arr[:, 4].astype(np.float64)  # Close price
+
+    # Chunks made entirely of closed bars never change; the trailing
+    # chunk still gets new bars, so it only stays fresh for a minute
+    now_ms = int(time.time() * 1000)
+    ttl = 'forever' if chunk_end_ms < now_ms - _BAR_MS else 60
+    payload = {'chunk_start': chunk_start_ms, 'chunk_end': chunk_end_ms,
+               'ts_ms': ts_ms.tolist(), 'closes': closes.tolist()}
+    _CACHE.put('binance_klines', cache_key, payload, params=cache_params, ttl=ttl)
+
+    # Stream the chunk columns out as soon as they land so a crashed run
+    # still leaves usable partial progress on disk
+    append_rows(progress_path, [payload])
+
+    return ts_ms, closes
+
+async def fetch_binance_historical_data(session, symbol, days):
+    """Fetch historical price data from Binance API with concurrent chunk fetches.
+
+    Returns a columnar DataFrame with a UTC 'timestamp' column and one
+    price column named after the symbol.
+    """
+
+    # Anchor the end of the window to the bar grid: a raw datetime.now()
+    # end would shift every chunk window — and every cache key derived
+    # from it — by a few milliseconds per run, so closed-chunk cache
+    # entries could never be hit again
+    end_ms = int(datetime.now().timestamp() * 1000) // _BAR_MS * _BAR_MS
+    start_ms = end_ms - days * 24 * _BAR_MS
+
+    print(f"Fetching data from {datetime.fromtimestamp(start_ms/1000)} to {datetime.fromtimestamp(end_ms/1000)}")
+    print(f"Total hours needed: {days * 24}")
+
+    # NDJSON sidecar collects one window-tagged record per finished chunk,
+    # in completion order; the exchange suffix keeps the 1D OKX and 1h
+    # Binance fetchers from absorbing each other's leftovers
+    progress_path = f"../backtest-data/{symbol.lower()}_prices_{days}d.binance.jsonl"
+
     # Binance limit is 1000 candles per request
     max_candles_per_request = 1000
-    
-    while current_start_ms < end_ms:
-        # Calculate end time for this chunk (don't exceed total end time)
-        chunk_end_ms = min(current_start_ms + (max_candles_per_request * 60 * 60 * 1000), end_ms)
-        
-        print(f"Fetching chunk: {datetime.fromtimestamp(current_start_ms/1000)} to {datetime.fromtimestamp(chunk_end_ms/1000)}")
-        
-        params = {
-            'symbol': f'{symbol}USDT',
-            'interval': '1h',
-            'startTime': current_start_ms,
-            'endTime': chunk_end_ms,
-            'limit': max_candles_per_request
-        }
-        
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            candles = response.json()
-            
-            print(f"Received {len(candles)} candles for this chunk")
-            
-            if not candles:
-                print("No more data available")
-                break
-            
-            # Convert Binance format to our format
-            for candle in candles:
-                timestamp = int(candle[0])  # Open time in milliseconds
-                close_price = float(candle[4])  # Close price
-                
-                price_data = {
-                    'timestamp': datetime.fromtimestamp(timestamp / 1000).isoformat() + 'Z',
-                    'prices': {
-                        symbol: close_price
-                    }
-                }
-                all_data.append(price_data)
-            
-            # Move to next chunk - start from the last candle's close time + 1 hour
-            if candles:
-                last_candle_time = int(candles[-1][0])
-                current_start_ms = last_candle_time + (60 * 60 * 1000)  # Add 1 hour
-            else:
-                break
-            
-            # Rate limiting to be nice to Binance API
-            time.sleep(0.1)
-            
-        except requests.RequestException as e:
-            print(f"Request error: {e}")
-            break
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-            break
-    
-    # Sort by timestamp (should already be sorted, but just in case)
-    all_data.sort(key=lambda x: x['timestamp'])
-    
-    # Remove duplicates (in case of overlap)
-    unique_data = []
-    seen_timestamps = set()
-    for item in all_data:
-        if item['timestamp'] not in seen_timestamps:
-            unique_data.append(item)
-            seen_timestamps.add(item['timestamp'])
-    
-    print(f"Successfully fetched {len(unique_data)} unique data points")
-    if unique_data:
-        print(f"Date range: {unique_data[0]['timestamp']} to {unique_data[-1]['timestamp']}")
-    
-    return unique_data
-
-def fetch_fear_greed_data(days):
-    """Fetch Fear & Greed index historical data"""
-    url = f"https://api.alternative.me/fng/?limit={days}"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        fear_greed_data = []
-        for item in data['data']:
-            fear_greed_data.append({
-                'timestamp': datetime.fromtimestamp(int(item['timestamp'])).isoformat() + 'Z',
-                'value': int(item['value']),
-                'classification': item['value_classification']
-            })
-        
-        # IMPORTANT: Fear & Greed API returns data in reverse order (newest first)
-        # We need to reverse it to match BTC data (oldest first)
-        fear_greed_data.reverse()
-            
-        return fear_greed_data
-        
-    except requests.RequestException as e:
-        print(f"Error fetching Fear & Greed data: {e}")
-        return []
-
-def main():
+    chunk_ms = max_candles_per_request * 60 * 60 * 1000
+
+    # Materialize the chunk edges as one int64 array instead of stepping a
+    # cursor in Python; consecutive edge pairs are the (start, end) windows
+    if start_ms < end_ms:
+        # Interior edges snap to the epoch-aligned chunk grid so the same
+        # closed windows (and cache keys) recur run after run; only the
+        # partial windows at both ends move with the requested range
+        interior = np.arange(start_ms // chunk_ms * chunk_ms + chunk_ms, end_ms, chunk_ms, dtype=np.int64)
+        edges = np.concatenate((np.asarray([start_ms], dtype=np.int64), interior,
+                                np.asarray([end_ms], dtype=np.int64)))
+        schedule = [(int(cs), int(ce)) for cs, ce in zip(edges[:-1], edges[1:])]
+    else:
+        schedule = []
+
+    # Chunks complete out of order, so an interrupted run leaves an
+    # arbitrary subset of windows in the sidecar — not a prefix. Reuse
+    # exactly the records whose windows are in the current schedule and
+    # fetch only the missing ones; resuming from the extremes instead
+    # would silently skip every unfinished window in between
+    scheduled = set(schedule)
+    done = {w: cols for w, cols in load_progress(progress_path).items() if w in scheduled}
+    if done:
+        print(f"Resuming {symbol}: {len(done)} of {len(schedule)} chunks already on disk")
+    else:
+        open(progress_path, 'wb').close()
+    pending = [w for w in schedule if w not in done]
+
+    fetched = await asyncio.gather(
+        *[fetch_binance_chunk(session, symbol, cs, ce, max_candles_per_request, progress_path)
+          for cs, ce in pending]
+    )
+    by_window = {**done, **dict(zip(pending, fetched))}
+    chunks = [by_window[w] for w in schedule]
+
+    # Concatenate the chunk columns (already ascending, schedule walks
+    # forward); np.unique keeps the first occurrence of each timestamp,
+    # which folds the boundary dedup into the merge
+    empty_ts, empty_closes = empty_chunk()
+    ts_ms = np.concatenate([empty_ts, *[c[0] for c in chunks]])
+    closes = np.concatenate([empty_closes, *[c[1] for c in chunks]])
+    ts_ms, first_idx = np.unique(ts_ms, return_index=True)
+    closes = closes[first_idx]
+
+    # One timestamp column plus one price column per symbol: two typed
+    # arrays instead of thousands of nested per-row dicts
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(ts_ms, unit='ms', utc=True),
+        symbol: closes
+    })
+
+    print(f"Successfully fetched {len(df)} unique data points")
+    if not df.empty:
+        print(f"Date range: {df['timestamp'].iloc[0]} to {df['timestamp'].iloc[-1]}")
+
+    return df
+
+async def main():
     parser = argparse.ArgumentParser(description='Fetch historical data from Binance API')
     parser.add_argument('--days', type=int, default=30, help='Number of days to fetch (default: 30)')
     parser.add_argument('--symbols', nargs='+', default=['BTC'], help='Crypto symbols to fetch (default: BTC)')
-    
+
     args = parser.parse_args()
-    
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # Expired short-TTL entries accumulate one per run; clear them out
+    _CACHE.prune()
+
     print(f"Fetching {args.days} days of historical data from Binance for {args.symbols}")
-    
-    # Fetch price data for each symbol
-    for symbol in args.symbols:
-        print(f"\nFetching price data for {symbol}...")
-        price_data = fetch_binance_historical_data(symbol, args.days)
-        
-        if price_data:
-            filename = f"../backtest-data/{symbol.lower()}_prices_{args.days}d.json"
-            with open(filename, 'w') as f:
-                json.dump(price_data, f, indent=2)
-            print(f"Saved {len(price_data)} price points to {filename}")
+
+    # All symbols and the Fear & Greed index fetch concurrently over one
+    # session; the shared limiter keeps the global request rate legal
+    # One long-lived connector for the whole run: DNS answers are cached
+    # for 5 minutes and idle keep-alive sockets are reused across chunks
+    # instead of re-resolving and re-handshaking per request
+    connector = aiohttp.TCPConnector(
+        limit=32,
+        limit_per_host=_PER_HOST_LIMIT,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [fetch_binance_historical_data(session, symbol, args.days) for symbol in args.symbols]
+        tasks.append(fetch_fear_greed_data(session, args.days, _CACHE))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    fear_greed_data = results.pop()
+
+    for symbol, price_data in zip(args.symbols, results):
+        if isinstance(price_data, Exception):
+            print(f"Error fetching price data for {symbol}: {price_data}")
+        elif not price_data.empty:
+            base = f"../backtest-data/{symbol.lower()}_prices_{args.days}d"
+
+            # Parquet is the compact columnar artifact for fast reloads;
+            # the row-oriented .json stays for the Rust backtest loader
+            price_data.to_parquet(f"{base}.parquet", compression='zstd')
+
+            write_json_array(f"{base}.json", price_rows(symbol, price_data))
+
+            # The progress sidecar is redundant once the final files exist
+            Path(f"{base}.binance.jsonl").unlink(missing_ok=True)
+
+            print(f"Saved {len(price_data)} price points to {base}.json")
         else:
             print(f"No data fetched for {symbol}")
-    
-    # Fetch Fear & Greed data
-    print("\nFetching Fear & Greed index data...")
-    fear_greed_data = fetch_fear_greed_data(args.days)
-    
-    if fear_greed_data:
+
+    if isinstance(fear_greed_data, Exception):
+        print(f"Error fetching Fear & Greed data: {fear_greed_data}")
+    elif fear_greed_data:
         filename = f"../backtest-data/fear_greed_{args.days}d.json"
-        with open(filename, 'w') as f:
-            json.dump(fear_greed_data, f, indent=2)
+        write_json_array(filename, fear_greed_data)
         print(f"Saved {len(fear_greed_data)} Fear & Greed points to {filename}")
-    
+
     print("\nBinance historical data fetch completed!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
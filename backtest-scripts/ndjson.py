@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import orjson
+
+def append_rows(path, rows):
+    """Append rows to an NDJSON file, one orjson-encoded record per line"""
+    with open(path, 'ab') as f:
+        for row in rows:
+            f.write(orjson.dumps(row))
+            f.write(b"\n")
+
+def load_rows(path):
+    """Load an NDJSON file back into a list of records"""
+    with open(path, 'rb') as f:
+        return [orjson.loads(line) for line in f]
+
+def load_rows_lenient(path):
+    """Load an NDJSON file, skipping lines that don't decode.
+
+    A writer killed mid-append can tear its final line, and progress
+    sidecars are read back after exactly that kind of crash — one bad
+    line shouldn't discard the readable records around it.
+    """
+    rows = []
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                rows.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                continue
+    return rows
+
+def write_json_array(path, rows):
+    """Stream rows into a JSON array one record at a time.
+
+    Keeps the .json output the backtest consumes while never materializing
+    the whole serialized array as a single buffer.
+    """
+    with open(path, 'wb') as f:
+        f.write(b"[")
+        for i, row in enumerate(rows):
+            if i:
+                f.write(b",")
+            f.write(orjson.dumps(row))
+        f.write(b"]\n")